@@ -12,13 +12,22 @@ Requirements (also include in requirements.txt):
 - pyrogram
 - tgcrypto
 - pikepdf
-- reportlab
 - pillow
+- uvloop (optional, Linux/macOS only)
+
+Optional: if the qpdf command-line tool is on PATH it is used for the page merge, which is faster on large PDFs.
+Note: pillow-simd is not a supported replacement for pillow here. It installs under the distribution name
+Pillow-SIMD, so it never satisfies pikepdf's Pillow requirement and pip installs Pillow alongside it; it also
+ships only source distributions, so installing it needs a compiler and the image library headers.
 
 Environment variables required:
 - BOT_TOKEN (Bot token from BotFather)
 - API_ID, API_HASH (from my.telegram.org)
 
+Optional environment variables:
+- DATA_DIR (where banners/ and tmp/ live, default ".")
+- BANNER_RESAMPLE (BILINEAR, BICUBIC or LANCZOS; filter used when shrinking a banner more than 2x, default BICUBIC)
+
 Run locally: python telegram_pdf_banner_bot.py
 
 Notes about Render deployment:
@@ -28,14 +37,29 @@ Notes about Render deployment:
 """
 
 import os
+import glob
+import json
+import functools
+import contextlib
+import zlib
+import time
+import shutil
 import asyncio
+import tempfile
+import hashlib
+import subprocess
+import multiprocessing
+from io import BytesIO
+from collections import OrderedDict
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pyrogram import Client, filters
+from pyrogram.handlers import MessageHandler
 from pyrogram.types import Message
 from PIL import Image
 import pikepdf
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import pt
-from io import BytesIO
+from pikepdf import Name
 
 # Configure paths
 DATA_DIR = os.environ.get("DATA_DIR", ".")
@@ -44,91 +68,200 @@ TMP_DIR = os.path.join(DATA_DIR, "tmp")
 os.makedirs(BANNER_DIR, exist_ok=True)
 os.makedirs(TMP_DIR, exist_ok=True)
 
-# Simple in-memory state: awaiting banner upload after /setbanner
-awaiting_banner = {}
+# PDF work is CPU-bound, so independent PDFs run in separate processes; the semaphore
+# bounds how many may be queued at once so a burst of uploads cannot exhaust memory
+PDF_WORKERS = max(2, (os.cpu_count() or 1) // 2)
+# Workers never fork the (multi-threaded) bot process: forkserver forks them from a clean
+# single-threaded server, spawn starts them fresh. Both re-import this module, which is why
+# the client, env check and event-loop setup only happen in create_app().
+PDF_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+PDF_POOL: Optional[ProcessPoolExecutor] = None
+pdf_slots = asyncio.Semaphore(PDF_WORKERS * 2)
+
+# Resampling filter for banners downscaled by more than 2x (BILINEAR, BICUBIC or LANCZOS);
+# smaller reductions always use BILINEAR, which is indistinguishable at page scale
+RESAMPLE_FILTERS = {"BILINEAR": Image.BILINEAR, "BICUBIC": Image.BICUBIC, "LANCZOS": Image.LANCZOS}
+_resample_name = os.environ.get("BANNER_RESAMPLE", "BICUBIC").upper()
+if _resample_name not in RESAMPLE_FILTERS:
+    print(f"Invalid BANNER_RESAMPLE {_resample_name!r}; expected one of {', '.join(RESAMPLE_FILTERS)}. Exiting.")
+    raise SystemExit(1)
+BANNER_RESAMPLE = RESAMPLE_FILTERS[_resample_name]
+
+# Edited PDFs whose original is smaller than this are built and uploaded from memory
+IN_MEMORY_LIMIT = 50 * 1024 * 1024
+
+# Recently produced PDFs, so a resent file (same content, same banner) is answered without
+# reprocessing. Maps key -> (path, size, created); LRU-evicted over the disk quota. The index
+# lives in memory, so whatever is on disk from a previous run is stale (see clean_tmp_dir).
+RESULT_CACHE_DIR = os.path.join(TMP_DIR, "cache")
+RESULT_CACHE_QUOTA = 500 * 1024 * 1024
+RESULT_CACHE_TTL = 3600
+RESULT_CACHE: "OrderedDict[str, tuple[str, int, float]]" = OrderedDict()
+os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+
+# qpdf's C++ page copier is preferred for the merge when installed
+QPDF_BIN = shutil.which("qpdf")
+
+# Chats awaiting a banner upload after /setbanner, persisted so a restart does not lose them
+AWAITING_PATH = os.path.join(DATA_DIR, "awaiting.json")
+awaiting_banner: set[int] = set()
+awaiting_lock = asyncio.Lock()
+try:
+    with open(AWAITING_PATH) as f:
+        awaiting_banner = set(json.load(f))
+except (OSError, ValueError):
+    pass
+
+# Chats with a banner on disk: one directory scan at startup, then kept current by
+# /setbanner and /removebanner so handlers never need to stat the banner file
+BANNER_PRESENT: set[int] = set()
+with os.scandir(BANNER_DIR) as it:
+    for entry in it:
+        if entry.is_dir() and entry.name.lstrip("-").isdigit() and os.path.exists(os.path.join(entry.path, "banner.png")):
+            BANNER_PRESENT.add(int(entry.name))
+
+# Rendered banner PDFs keyed by (chat_id, banner mtime_ns, size name)
+BANNER_PDF_CACHE: dict[tuple, str] = {}
+
+# Page sizes (points) pre-rendered on /setbanner; pages within 1pt of one reuse its banner PDF
+COMMON_PAGE_SIZES = {
+    "A4": (595.276, 841.89),
+    "Letter": (612.0, 792.0),
+}
+
+# Keep references to fire-and-forget tasks so they are not garbage-collected mid-run
+background_tasks: set[asyncio.Task] = set()
+
+def _save_awaiting():
+    tmp = AWAITING_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(sorted(awaiting_banner), f)
+    os.replace(tmp, AWAITING_PATH)
+
+
+async def set_awaiting(chat_id: int, awaiting: bool):
+    async with awaiting_lock:
+        if awaiting:
+            awaiting_banner.add(chat_id)
+        else:
+            awaiting_banner.discard(chat_id)
+        _save_awaiting()
 
-BOT_TOKEN = os.environ.get("BOT_TOKEN")
-API_ID = int(os.environ.get("API_ID", 0)) if os.environ.get("API_ID") else None
-API_HASH = os.environ.get("API_HASH")
 
-if not BOT_TOKEN or not API_ID or not API_HASH:
-    print("Missing BOT_TOKEN or API_ID/API_HASH environment variables. Exiting.")
-    raise SystemExit(1)
+# pyrogram has no mime-type filter, so build one for PDF documents
+async def _is_pdf_document(_, __, m: Message) -> bool:
+    return bool(m.document and m.document.mime_type == "application/pdf")
+
+
+pdf_document = filters.create(_is_pdf_document)
 
-app = Client("pdf_banner_bot", bot_token=BOT_TOKEN, api_id=API_ID, api_hash=API_HASH)
+# Only the first matching handler in a group runs, so keep PDFs out of the banner-image handler
+banner_image = filters.photo | (filters.document & ~pdf_document)
 
 
-def banner_path_for_chat(chat_id: int) -> str:
+@functools.lru_cache(maxsize=4096)
+def _banner_dir(chat_id: int) -> str:
     d = os.path.join(BANNER_DIR, str(chat_id))
     os.makedirs(d, exist_ok=True)
+    return d
+
+
+def banner_path_for_chat(chat_id: int, read_only: bool = False) -> str:
+    # Readers only need the path; creating the directory is left to writers
+    d = os.path.join(BANNER_DIR, str(chat_id)) if read_only else _banner_dir(chat_id)
     return os.path.join(d, "banner.png")
 
 
-@app.on_message(filters.command("start"))
+def has_banner(chat_id: int) -> bool:
+    return chat_id in BANNER_PRESENT
+
+
 async def start_cmd(client: Client, message: Message):
     await message.reply_text("Hello! Send /setbanner to upload a banner, then send a PDF to replace its first page with that banner.")
 
 
-@app.on_message(filters.command("setbanner"))
 async def setbanner_cmd(client: Client, message: Message):
     chat_id = message.chat.id
-    awaiting_banner[chat_id] = True
+    await set_awaiting(chat_id, True)
     await message.reply_text("Okay — send the banner image now as a photo or image file. I will save it for this chat.")
 
 
-@app.on_message(filters.command("removebanner"))
 async def removebanner_cmd(client: Client, message: Message):
     chat_id = message.chat.id
-    path = banner_path_for_chat(chat_id)
-    if os.path.exists(path):
-        os.remove(path)
+    path = banner_path_for_chat(chat_id, read_only=True)
+    if has_banner(chat_id):
+        BANNER_PRESENT.discard(chat_id)
+        # BANNER_PRESENT is not re-checked against the disk, so the files may already be gone
+        for stale in [path, *glob.glob(os.path.join(os.path.dirname(path), "banner_*.pdf"))]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stale)
         await message.reply_text("Banner removed for this chat.")
     else:
         await message.reply_text("No banner was set for this chat.")
 
 
-@app.on_message(filters.command("status"))
 async def status_cmd(client: Client, message: Message):
     chat_id = message.chat.id
-    path = banner_path_for_chat(chat_id)
-    if os.path.exists(path):
+    if has_banner(chat_id):
         await message.reply_text("Banner is set for this chat.")
     else:
         await message.reply_text("No banner set. Use /setbanner to upload one.")
 
 
-@app.on_message(filters.photo | filters.document)
+def _has_alpha(img: Image.Image) -> bool:
+    return "A" in img.mode or img.info.get("transparency") is not None
+
+
+def save_banner_image(src_path: str, dest_path: str):
+    # Image.open only parses the header, so this check does not decode any pixels
+    with Image.open(src_path) as img:
+        passthrough = img.format in ("PNG", "JPEG") and img.mode in ("RGB", "RGBA", "L")
+        if not passthrough:
+            img.convert("RGBA" if _has_alpha(img) else "RGB").save(dest_path, format="PNG")
+    if passthrough:
+        # PIL sniffs the real format when reading, so a JPEG can live under banner.png as-is
+        os.replace(src_path, dest_path)
+
+
 async def receive_image(client: Client, message: Message):
     chat_id = message.chat.id
-    if not awaiting_banner.get(chat_id):
+    if chat_id not in awaiting_banner:
         return  # ignore images unless we asked for them
 
     # Accept photo OR document that is an image
     file = None
     try:
-        if message.photo:
-            file = await client.download_media(message.photo.file_id, file_name=os.path.join(TMP_DIR, f"{message.message_id}_banner"))
-        elif message.document and message.document.mime_type.startswith("image"):
-            file = await client.download_media(message.document.file_id, file_name=os.path.join(TMP_DIR, f"{message.message_id}_banner"))
-        else:
-            await message.reply_text("Please send a PNG or JPG image.")
-            return
-
-        # Normalize and save as PNG
-        img = Image.open(file)
-        dest = banner_path_for_chat(chat_id)
-        img.convert("RGBA").save(dest, format="PNG")
-        awaiting_banner.pop(chat_id, None)
+        with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp:
+            if message.photo:
+                file = await client.download_media(message.photo.file_id, file_name=os.path.join(tmp, "banner"))
+            elif message.document and message.document.mime_type.startswith("image"):
+                file = await client.download_media(message.document.file_id, file_name=os.path.join(tmp, "banner"))
+            else:
+                await message.reply_text("Please send a PNG or JPG image.")
+                return
+
+            # Normalize and save as PNG
+            dest = banner_path_for_chat(chat_id)
+            await asyncio.to_thread(save_banner_image, file, dest)
+        # Renders of the previous banner can no longer be looked up; drop them from disk
+        for stale in glob.glob(os.path.join(os.path.dirname(dest), "banner_*.pdf")):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stale)
+        BANNER_PRESENT.add(chat_id)
+        await set_awaiting(chat_id, False)
+        # Render the usual page sizes now so the first PDF after /setbanner skips that work
+        task = asyncio.create_task(run_in_pdf_pool(prerender_banner_pdfs, chat_id))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
         await message.reply_text("Banner saved for this chat.")
     except Exception as e:
-        awaiting_banner.pop(chat_id, None)
+        await set_awaiting(chat_id, False)
         await message.reply_text(f"Failed to save banner: {e}")
 
 
-async def create_banner_pdf_from_image(img_path: str, out_pdf_path: str, width_pt: float, height_pt: float):
-    """Create a single-page PDF sized width_pt x height_pt (points) with the image stretched to fit."""
-    # reportlab works in points. We'll create a canvas and draw the image scaled to the page.
-    c = canvas.Canvas(out_pdf_path, pagesize=(width_pt, height_pt))
+def build_banner_page(pdf: pikepdf.Pdf, img_path: str, width_pt: float, height_pt: float) -> pikepdf.Page:
+    """Build a width_pt x height_pt page owned by pdf, showing only the banner image fitted and centred."""
     # Use PIL to open image and preserve orientation
     img = Image.open(img_path)
     iw, ih = img.size
@@ -138,44 +271,212 @@ async def create_banner_pdf_from_image(img_path: str, out_pdf_path: str, width_p
     new_h = ih * ratio
     x = (width_pt - new_w) / 2
     y = (height_pt - new_h) / 2
-    # Save a temporary resized version in memory
-    buf = BytesIO()
-    img = img.convert("RGBA")
-    img.resize((int(new_w), int(new_h)), Image.LANCZOS).save(buf, format="PNG")
-    buf.seek(0)
-    c.drawImage(buf, x, y, width=new_w, height=new_h, mask='auto')
-    c.showPage()
-    c.save()
-
-
-async def replace_first_page_with_banner(original_pdf_path: str, banner_img_path: str, output_pdf_path: str):
-    # Open original to read page size
-    with pikepdf.Pdf.open(original_pdf_path) as original:
+    downscale = iw > new_w * 1.5
+
+    alpha = None
+    if img.format == "JPEG" and img.mode in ("RGB", "L") and not downscale:
+        # Embed the JPEG bytes as-is; PDF viewers decode DCT natively
+        with open(img_path, "rb") as f:
+            data = f.read()
+        stream_filter = Name.DCTDecode
+    else:
+        # JPEGs are decoded at a reduced scale when that is still large enough; no-op for PNG
+        img.draft("RGB", (int(new_w), int(new_h)))
+        # Only keep an alpha channel when the banner actually has transparency
+        if _has_alpha(img):
+            img = img.convert("RGBA")
+        elif img.mode != "L":
+            img = img.convert("RGB")
+        # Only downscale when the source is much larger than the page; the PDF viewer scales the rest
+        scale = max(img.width / new_w, img.height / new_h)
+        if scale > 1.5:
+            resample = BANNER_RESAMPLE if scale > 2 else Image.BILINEAR
+            img = img.resize((int(new_w), int(new_h)), resample)
+        if img.mode == "RGBA":
+            alpha = img.getchannel("A")
+            img = img.convert("RGB")
+        data = zlib.compress(img.tobytes())
+        stream_filter = Name.FlateDecode
+
+    image = pikepdf.Stream(
+        pdf,
+        data,
+        Type=Name.XObject,
+        Subtype=Name.Image,
+        Width=img.width,
+        Height=img.height,
+        ColorSpace=Name.DeviceGray if img.mode == "L" else Name.DeviceRGB,
+        BitsPerComponent=8,
+        Filter=stream_filter,
+    )
+    if alpha is not None:
+        image.SMask = pikepdf.Stream(
+            pdf,
+            zlib.compress(alpha.tobytes()),
+            Type=Name.XObject,
+            Subtype=Name.Image,
+            Width=img.width,
+            Height=img.height,
+            ColorSpace=Name.DeviceGray,
+            BitsPerComponent=8,
+            Filter=Name.FlateDecode,
+        )
+
+    contents = pikepdf.Stream(pdf, f"q {new_w:.4f} 0 0 {new_h:.4f} {x:.4f} {y:.4f} cm /Im0 Do Q".encode())
+    page = pikepdf.Dictionary(
+        Type=Name.Page,
+        MediaBox=[0, 0, width_pt, height_pt],
+        Contents=contents,
+        Resources=pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image)),
+    )
+    return pikepdf.Page(pdf.make_indirect(page))
+
+
+def create_banner_pdf_from_image(img_path: str, out_pdf_path: str, width_pt: float, height_pt: float):
+    """Create a single-page PDF sized width_pt x height_pt (points) with the image stretched to fit."""
+    # Several workers may render the same size at once; publish the file atomically
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(out_pdf_path), suffix=".pdf", delete=False) as tmp:
+        tmp_path = tmp.name
+    try:
+        with pikepdf.Pdf.new() as pdf:
+            pdf.pages.append(build_banner_page(pdf, img_path, width_pt, height_pt))
+            pdf.save(tmp_path)
+        os.replace(tmp_path, out_pdf_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _banner_pdf_size(width_pt: float, height_pt: float) -> tuple[str, float, float]:
+    for name, (w, h) in COMMON_PAGE_SIZES.items():
+        if abs(width_pt - w) <= 1 and abs(height_pt - h) <= 1:
+            return name, w, h
+    w, h = round(width_pt, 2), round(height_pt, 2)
+    return f"{w}x{h}", w, h
+
+
+def get_or_build_banner_pdf(chat_id: int, width_pt: float, height_pt: float) -> str:
+    """Return a banner PDF for this chat and page size, rendering it only when the banner changed."""
+    img_path = banner_path_for_chat(chat_id, read_only=True)
+    mtime_ns = os.stat(img_path).st_mtime_ns
+    name, w, h = _banner_pdf_size(width_pt, height_pt)
+    key = (chat_id, mtime_ns, name)
+    cached = BANNER_PDF_CACHE.get(key)
+    if cached and os.path.exists(cached):
+        return cached
+
+    # The banner's mtime is part of the name, so a render of an older banner that lands late
+    # can never be mistaken for this one; a file left over from a previous run is reused as-is
+    pdf_path = os.path.join(os.path.dirname(img_path), f"banner_{name}_{mtime_ns}.pdf")
+    if not os.path.exists(pdf_path):
+        create_banner_pdf_from_image(img_path, pdf_path, w, h)
+    # Forget renders of this chat's superseded banners so the dict does not grow forever
+    for old in [k for k in BANNER_PDF_CACHE if k[0] == chat_id and k[1] != mtime_ns]:
+        del BANNER_PDF_CACHE[old]
+    BANNER_PDF_CACHE[key] = pdf_path
+    return pdf_path
+
+
+def prerender_banner_pdfs(chat_id: int):
+    for w, h in COMMON_PAGE_SIZES.values():
+        get_or_build_banner_pdf(chat_id, w, h)
+
+
+def replace_first_page_with_banner(original_pdf_path: str, chat_id: int, output_pdf_path: Optional[str] = None) -> Optional[bytes]:
+    """Write the edited PDF to output_pdf_path, or return its bytes when no path is given."""
+    with pikepdf.Pdf.open(original_pdf_path, access_mode=pikepdf.AccessMode.mmap) as original:
         if len(original.pages) == 0:
             raise ValueError("PDF has no pages")
-        # Get media box of first page
-        mbox = original.pages[0].MediaBox
-        # MediaBox gives [llx, lly, urx, ury]
-        llx, lly, urx, ury = [float(x) for x in mbox]
+        # mediabox resolves a MediaBox inherited from the page tree; gives [llx, lly, urx, ury]
+        llx, lly, urx, ury = [float(x) for x in original.pages[0].mediabox]
         width_pt = abs(urx - llx)
         height_pt = abs(ury - lly)
+        page_count = len(original.pages)
+
+        banner_pdf_path = get_or_build_banner_pdf(chat_id, width_pt, height_pt)
+
+        if not QPDF_BIN:
+            # Replace page 0 in place: only the banner page is copied across, the
+            # remaining pages and their shared resources are left untouched.
+            with pikepdf.Pdf.open(banner_pdf_path) as banner_pdf:
+                original.pages[0] = banner_pdf.pages[0]
+                target = output_pdf_path or BytesIO()
+                original.save(target, linearize=False, object_stream_mode=pikepdf.ObjectStreamMode.preserve)
+            return None if output_pdf_path else target.getvalue()
+
+    # The original stays the primary input so its metadata and outlines are kept.
+    # This already runs in a worker process, so a blocking subprocess call is fine.
+    # An output of "-" makes qpdf write the PDF to stdout.
+    pages = [banner_pdf_path, "1"] + ([original_pdf_path, "2-z"] if page_count > 1 else [])
+    proc = subprocess.run([QPDF_BIN, original_pdf_path, "--pages", *pages, "--", output_pdf_path or "-"],
+                          capture_output=True)
+    # Exit status 3 means qpdf succeeded with warnings (common for slightly damaged PDFs)
+    if proc.returncode not in (0, 3):
+        raise RuntimeError(f"qpdf failed: {proc.stderr.decode(errors='replace').strip()}")
+    return None if output_pdf_path else proc.stdout
+
+
+def result_cache_key(pdf_path: str, chat_id: int) -> str:
+    # Only originals under IN_MEMORY_LIMIT are cached, so hashing the whole file stays cheap
+    h = hashlib.blake2b(digest_size=16)
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    st = os.stat(banner_path_for_chat(chat_id, read_only=True))
+    h.update(f"{chat_id}:{st.st_mtime_ns}:{st.st_size}".encode())
+    return h.hexdigest()
+
+
+def _drop_cached_result(key: str):
+    path, _, _ = RESULT_CACHE.pop(key)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def get_cached_result(key: str) -> Optional[str]:
+    entry = RESULT_CACHE.get(key)
+    if entry is None:
+        return None
+    path, _, created = entry
+    if time.time() - created > RESULT_CACHE_TTL or not os.path.exists(path):
+        _drop_cached_result(key)
+        return None
+    RESULT_CACHE.move_to_end(key)
+    return path
+
+
+def _write_cached_result(key: str, data: bytes) -> str:
+    path = os.path.join(RESULT_CACHE_DIR, f"{key}.pdf")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def remember_result(key: str, path: str, size: int):
+    RESULT_CACHE[key] = (path, size, time.time())
+    while sum(entry[1] for entry in RESULT_CACHE.values()) > RESULT_CACHE_QUOTA:
+        _drop_cached_result(next(iter(RESULT_CACHE)))
 
-    banner_pdf_tmp = os.path.join(TMP_DIR, f"banner_{os.path.basename(banner_img_path)}.pdf")
-    await create_banner_pdf_from_image(banner_img_path, banner_pdf_tmp, width_pt, height_pt)
 
-    # Now merge: create new PDF starting with banner page, then append original pages from index 1 onward
-    with pikepdf.Pdf.open(banner_pdf_tmp) as banner_pdf, pikepdf.Pdf.open(original_pdf_path) as original:
-        out = pikepdf.Pdf.new()
-        # Add banner page(s)
-        for p in banner_pdf.pages:
-            out.pages.append(p)
-        # Append remaining pages from original (skip first)
-        for i in range(1, len(original.pages)):
-            out.pages.append(original.pages[i])
-        out.save(output_pdf_path)
+def new_pdf_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=PDF_MP_CONTEXT)
+
+
+async def run_in_pdf_pool(func, *args):
+    """Run func in PDF_POOL, replacing the pool if a dead worker has broken it."""
+    global PDF_POOL
+    pool = PDF_POOL
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # A worker was killed (OOM, native crash); without a fresh pool every later submit fails.
+        # The job is not retried: if its input caused the crash it would take the new pool down too.
+        if PDF_POOL is pool:
+            pool.shutdown(wait=False)
+            PDF_POOL = new_pdf_pool()
+        raise RuntimeError("the PDF worker crashed while processing this file") from None
 
 
-@app.on_message(filters.command("process") & filters.reply)
 async def process_cmd(client: Client, message: Message):
     # User replied to a PDF with /process
     if not message.reply_to_message:
@@ -184,28 +485,92 @@ async def process_cmd(client: Client, message: Message):
     await handle_pdf_message(client, message.reply_to_message)
 
 
-@app.on_message(filters.document & filters.mime_type("application/pdf"))
-async def handle_pdf_message(client: Client, message: Message):
+async def on_pdf(client: Client, message: Message):
     await handle_pdf_message(client, message)
 
 
 async def handle_pdf_message(client: Client, message: Message):
     chat_id = message.chat.id
-    path = banner_path_for_chat(chat_id)
-    if not os.path.exists(path):
+    if not has_banner(chat_id):
         await message.reply_text("No banner set for this chat. Use /setbanner to upload a banner first.")
         return
 
-    # download PDF
+    caption = "Here is your edited PDF (first page replaced with banner)."
+    # download PDF; everything written for this message is removed when the block exits
     try:
-        orig_file = await client.download_media(message.document.file_id, file_name=os.path.join(TMP_DIR, f"{message.message_id}_orig.pdf"))
-        out_file = os.path.join(TMP_DIR, f"{message.message_id}_out.pdf")
-        await replace_first_page_with_banner(orig_file, path, out_file)
-        await client.send_document(chat_id, out_file, caption="Here is your edited PDF (first page replaced with banner).")
+        with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp:
+            orig_file = await client.download_media(message.document.file_id, file_name=os.path.join(tmp, "orig.pdf"))
+            # Small results skip the disk round-trip; large ones are written out so RAM stays bounded.
+            # Only small results are cached: large ones would quickly exhaust the cache quota.
+            out_file = None
+            key = None
+            if os.path.getsize(orig_file) >= IN_MEMORY_LIMIT:
+                out_file = os.path.join(tmp, "out.pdf")
+            else:
+                key = await asyncio.to_thread(result_cache_key, orig_file, chat_id)
+                cached = get_cached_result(key)
+                if cached:
+                    await client.send_document(chat_id, cached, file_name="edited.pdf", caption=caption)
+                    return
+            # pikepdf/PIL are CPU-bound; run them in the process pool so other chats keep being served
+            async with pdf_slots:
+                data = await run_in_pdf_pool(replace_first_page_with_banner, orig_file, chat_id, out_file)
+            document = out_file or BytesIO(data)
+            await client.send_document(chat_id, document, file_name="edited.pdf", caption=caption)
+            if key:
+                remember_result(key, await asyncio.to_thread(_write_cached_result, key, data), len(data))
     except Exception as e:
         await message.reply_text(f"Failed to process PDF: {e}")
 
 
+def clean_tmp_dir():
+    """Remove leftovers of a previous run; only the bot process calls this, never pool workers."""
+    # Per-request temp dirs are removed after each message; sweep anything left behind by a crash
+    for entry in os.scandir(TMP_DIR):
+        if entry.path != RESULT_CACHE_DIR and entry.stat().st_mtime < time.time() - 3600:
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+    # The result cache index starts empty, so its files are unreachable
+    shutil.rmtree(RESULT_CACHE_DIR, ignore_errors=True)
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+
+
+def create_app() -> Client:
+    """Check the environment, set up the event loop and build the client with its handlers."""
+    bot_token = os.environ.get("BOT_TOKEN")
+    api_id = int(os.environ.get("API_ID", 0)) if os.environ.get("API_ID") else None
+    api_hash = os.environ.get("API_HASH")
+
+    if not bot_token or not api_id or not api_hash:
+        print("Missing BOT_TOKEN or API_ID/API_HASH environment variables. Exiting.")
+        raise SystemExit(1)
+
+    # uvloop's libuv-based event loop is faster than the stock one; optional, not available on Windows
+    try:
+        import uvloop
+        uvloop.install()
+        # pyrogram grabs the current loop at construction; newer uvloop no longer creates one implicitly
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    except ImportError:
+        pass
+
+    app = Client("pdf_banner_bot", bot_token=bot_token, api_id=api_id, api_hash=api_hash)
+    # Registration order matters: within a group pyrogram runs only the first matching handler
+    app.add_handler(MessageHandler(start_cmd, filters.command("start")))
+    app.add_handler(MessageHandler(setbanner_cmd, filters.command("setbanner")))
+    app.add_handler(MessageHandler(removebanner_cmd, filters.command("removebanner")))
+    app.add_handler(MessageHandler(status_cmd, filters.command("status")))
+    app.add_handler(MessageHandler(receive_image, banner_image))
+    app.add_handler(MessageHandler(process_cmd, filters.command("process") & filters.reply))
+    app.add_handler(MessageHandler(on_pdf, pdf_document))
+    return app
+
+
 if __name__ == "__main__":
+    app = create_app()
     print("Starting PDF Banner Replacer Bot...")
+    clean_tmp_dir()
+    PDF_POOL = new_pdf_pool()
     app.run()
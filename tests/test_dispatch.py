@@ -0,0 +1,40 @@
+import asyncio
+import importlib
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    monkeypatch.setenv("BOT_TOKEN", "1:test")
+    monkeypatch.setenv("API_ID", "1")
+    monkeypatch.setenv("API_HASH", "test")
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    sys.modules.pop("main", None)
+    yield importlib.import_module("main")
+    sys.modules.pop("main", None)
+
+
+def _document(mime_type):
+    return SimpleNamespace(photo=None, document=SimpleNamespace(mime_type=mime_type))
+
+
+def test_pdf_dispatcher_is_not_the_handler(main):
+    assert main.on_pdf is not main.handle_pdf_message
+
+
+def test_pdf_documents_are_routed_to_pdf_handler_only(main):
+    pdf = _document("application/pdf")
+    assert asyncio.run(main.pdf_document(None, pdf))
+    assert not asyncio.run(main.banner_image(None, pdf))
+
+
+def test_image_documents_are_routed_to_banner_handler(main):
+    png = _document("image/png")
+    assert asyncio.run(main.banner_image(None, png))
+    assert not asyncio.run(main.pdf_document(None, png))